@@ -2,26 +2,38 @@
 # AutoPDF Bot - A Telegram bot that fills PDF forms with user data
 
 import os
+import asyncio
 import logging
 from typing import Dict, List, Optional, Tuple
-import json
 import io
-from datetime import datetime, timedelta
+import re
+import html
+import sqlite3
+import time
+from contextlib import suppress
+from datetime import datetime
 from dotenv import load_dotenv
-import tempfile
-from telegram.constants import ParseMode
+import threading
+from collections import OrderedDict
+import dataclasses
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from telegram.constants import MessageLimit, ParseMode
 
-# Force reload of environment variables
-os.environ.clear()
+# Load environment variables, letting values in .env take precedence
 load_dotenv(override=True)
 
 # Telegram imports
 from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove
 from telegram.ext import (
+    AIORateLimiter,
     Application, 
+    ApplicationHandlerStop,
+    BaseUpdateProcessor,
     CommandHandler, 
     ContextTypes, 
     MessageHandler, 
+    TypeHandler,
     filters,
     ConversationHandler,
     CallbackContext
@@ -29,11 +41,12 @@ from telegram.ext import (
 
 # Google Drive integration
 from google.oauth2.service_account import Credentials
-from googleapiclient.discovery import build
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient.discovery_cache import get_static_doc
 from googleapiclient.http import MediaIoBaseDownload
 
 # PDF processing
-from PyPDF2 import PdfReader, PdfWriter
+import pikepdf
 
 # Configure logging
 logging.basicConfig(
@@ -42,6 +55,10 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# httpx logs every Bot API request (including each getUpdates poll) at INFO level
+logging.getLogger('httpx').setLevel(logging.WARNING)
+logging.getLogger('googleapiclient.discovery_cache').setLevel(logging.ERROR)
+
 # Define conversation states
 SELECTING_TEMPLATE = 0
 CHOOSING_FIELD_NAMES = 1
@@ -51,12 +68,49 @@ BULK_ENTRY = 4
 CHOOSING = 5
 TYPING_REPLY = 6
 CHOOSING_NEXT_ACTION = 7
+VIEWING_FIELDS = 8
+
+# Reply markups for the fixed menus; they never change, so one instance of each is shared
+REMOVE_KEYBOARD = ReplyKeyboardRemove()
+FIELD_NAMING_KEYBOARD = ReplyKeyboardMarkup(
+    [['Customize Field Names'], ['Use Default Names']],
+    one_time_keyboard=True,
+    input_field_placeholder="Choose an option",
+)
+FILL_METHOD_KEYBOARD = ReplyKeyboardMarkup(
+    [["Fill Fields One-by-One"], ["Fill All Fields at Once"]], one_time_keyboard=True
+)
+NEXT_ACTION_KEYBOARD = ReplyKeyboardMarkup(
+    [['Send Again'], ['New Form'], ['Exit']], one_time_keyboard=True
+)
+
+# Offered while filling fields one-by-one, to send all the remaining ones in a single message
+FILL_REMAINING_AT_ONCE = "Fill Remaining Fields at Once"
+
+# Minimum number of unfilled fields for FILL_REMAINING_AT_ONCE to be offered
+FILL_REMAINING_MIN_FIELDS = 3
 
 # Configuration from environment
 TELEGRAM_TOKEN = os.environ.get('TELEGRAM_TOKEN')
 CREDENTIALS_FILE = os.environ.get('GOOGLE_CREDENTIALS_FILE', 'google_credentials.json')
 OUTPUT_DIR = os.environ.get('OUTPUT_DIR', 'generated')
 
+# Telegram user IDs allowed to use the bot (comma-separated); everyone is allowed when empty
+ALLOWED_USERS = {int(user_id) for user_id in os.environ.get('ALLOWED_USERS', '').split(',') if user_id.strip()}
+
+# Maximum number of updates (across all chats) processed at the same time
+MAX_CONCURRENT_UPDATES = 64
+
+# Seconds of inactivity after which an unfinished conversation is ended and its data dropped
+CONVERSATION_TIMEOUT = 15 * 60
+
+# Webhook configuration (long polling is used when WEBHOOK_URL is not set)
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL')
+PORT = int(os.environ.get('PORT', '8443'))
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET')
+# URL path the webhook is served on, defaults to the bot token
+WEBHOOK_PATH = (os.environ.get('WEBHOOK_PATH') or TELEGRAM_TOKEN or '').strip('/')
+
 # Validate required configuration
 if not TELEGRAM_TOKEN:
     raise ValueError("No TELEGRAM_TOKEN found in environment variables. Please set it in .env file.")
@@ -66,6 +120,31 @@ SCOPES = [
     'https://www.googleapis.com/auth/drive'
 ]
 
+# Templates larger than this are downloaded as parallel byte ranges
+DOWNLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+DOWNLOAD_WORKERS = 4
+
+# How long (in seconds) the Drive template listing is reused before refreshing
+TEMPLATE_LIST_TTL = 300
+
+# Minimum seconds between refreshes of the listing forced by an unknown template name
+TEMPLATE_MISS_REFRESH_INTERVAL = 30
+
+# Number of downloaded templates (bytes + extracted fields) kept in memory
+TEMPLATE_CACHE_SIZE = 32
+
+# How long generated PDFs are kept before cleanup removes them (7 days)
+PDF_RETENTION_SECONDS = 7 * 24 * 60 * 60
+
+# Most generated PDFs kept on disk; the oldest beyond this are removed after each save, even if unexpired
+MAX_RETAINED_PDFS = 1000
+
+# How often (in seconds) expired PDFs are removed
+PDF_CLEANUP_INTERVAL = 60 * 60
+
+# Retries (with exponential backoff) for Drive requests failing with 429/5xx or connection errors
+DRIVE_NUM_RETRIES = 5
+
 # Field name mapping for better display names
 FIELD_MAPPING = {
     # Default mappings for common form fields
@@ -104,6 +183,9 @@ FIELD_MAPPING = {
     # Add more mappings as needed
 }
 
+# FIELD_MAPPING keyed by lowercase name, so 'Name', 'NAME' and 'name' all match
+_FIELD_MAPPING_LOWER = {name.lower(): display_name for name, display_name in FIELD_MAPPING.items()}
+
 # Template-specific field mappings
 # Structure: {'template_id': {'internal_field_name': 'User Friendly Name'}}
 TEMPLATE_FIELD_MAPPINGS = {
@@ -124,6 +206,10 @@ TEMPLATE_FIELD_MAPPINGS = {
     # You can add mappings for any number of templates here
 }
 
+# Position before each capital letter, where camelCase names get a space
+_CAMEL_CASE_BOUNDARY = re.compile(r'(?=[A-Z])')
+
+@lru_cache(maxsize=4096)
 def get_display_name(field_name, template_id=None):
     """Convert internal field names to user-friendly display names
     
@@ -141,8 +227,9 @@ def get_display_name(field_name, template_id=None):
             return template_mappings[field_name]
     
     # Fall back to default mappings if no template-specific mapping exists
-    if field_name in FIELD_MAPPING:
-        return FIELD_MAPPING[field_name]
+    display_name = _FIELD_MAPPING_LOWER.get(field_name.lower())
+    if display_name:
+        return display_name
     
     # Try to make the field name more readable if no mapping exists
     # Convert camelCase or snake_case to Title Case with spaces
@@ -152,17 +239,44 @@ def get_display_name(field_name, template_id=None):
     display_name = display_name.replace('_', ' ')
     
     # Insert space before capitals in camelCase
-    display_name = ''.join([' ' + c if c.isupper() else c for c in display_name]).strip()
+    display_name = _CAMEL_CASE_BOUNDARY.sub(' ', display_name).strip()
     
     # Title case the result
     display_name = display_name.title()
     
     return display_name
 
+@dataclasses.dataclass(slots=True)
+class FormSession:
+    """Per-user state for the form being filled, kept in user_data['session']"""
+    template_id: Optional[str] = None
+    template_name: str = ""
+    safe_template_name: str = ""
+    template: Optional[io.BytesIO] = None
+    fields: List[str] = dataclasses.field(default_factory=list)
+    field_index: Optional[Dict] = None
+    field_mappings: Dict[str, str] = dataclasses.field(default_factory=dict)
+    field_keyboard_rows: List[List[str]] = dataclasses.field(default_factory=list)
+    field_by_display_name: Dict[str, str] = dataclasses.field(default_factory=dict)
+    remaining: set = dataclasses.field(default_factory=set)
+    choice: Optional[str] = None
+    form_data: Dict[str, str] = dataclasses.field(default_factory=dict)
+    last_pdf_bytes: Optional[bytes] = None
+    last_pdf_filename: Optional[str] = None
+    last_pdf_path: Optional[str] = None
+
+def get_session(context: ContextTypes.DEFAULT_TYPE) -> FormSession:
+    """Return the user's current form session, creating it if needed"""
+    session = context.user_data.get('session')
+    if session is None:
+        session = context.user_data['session'] = FormSession()
+    return session
+
 def create_custom_field_mapping(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Create or update custom field mappings for the current form"""
-    fields = context.user_data.get('fields', [])
-    template_id = context.user_data.get('template_id')
+    session = get_session(context)
+    fields = session.fields
+    template_id = session.template_id
     custom_mappings = {}
     
     for field in fields:
@@ -170,54 +284,46 @@ def create_custom_field_mapping(update: Update, context: ContextTypes.DEFAULT_TY
         display_name = get_display_name(field, template_id)
         custom_mappings[field] = display_name
     
-    # Store the custom mappings in user data
-    context.user_data['field_mappings'] = custom_mappings
+    # Store the custom mappings in the session
+    session.field_mappings = custom_mappings
     
     return custom_mappings
 
 async def customize_field_names(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Allow the user to customize field names"""
-    fields = context.user_data.get('fields', [])
-    
     # Create a mapping first
     mappings = create_custom_field_mapping(update, context)
     
     # Create a message template for customization
-    message = "Current field names:\n\n"
-    for field, display_name in mappings.items():
-        message += f"{field} → {display_name}\n"
-    
-    message += "\nTo customize field names, reply with the changes in this format:\n"
-    message += "field_name1: New Display Name 1\nfield_name2: New Display Name 2\n"
-    message += "\nOr type 'skip' to keep current names."
-    
-    await update.message.reply_text(message)
+    parts = ["Current field names:\n\n"]
+    parts.extend(f"{field} → {display_name}\n" for field, display_name in mappings.items())
+    parts.append(
+        "\nTo customize field names, reply with the changes in this format:\n"
+        "field_name1: New Display Name 1\nfield_name2: New Display Name 2\n"
+        "\nOr type 'skip' to keep current names."
+    )
     
-    # Set state for collecting custom field names
-    context.user_data['awaiting_field_names'] = True
+    await reply_in_chunks(update.message, parts)
     
     return CUSTOMIZING_FIELDS
 
 async def process_field_customization(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Process the user's custom field name mappings"""
     text = update.message.text
+    session = get_session(context)
     
     if text.lower() == 'skip':
         # Skip customization and move to filling method choice
-        fields = context.user_data['fields']
-        reply_keyboard = [["Fill Fields One-by-One"], ["Fill All Fields at Once"]]
-        
+        fields = session.fields
         await update.message.reply_text(
             f"Using default field names. How would you like to fill this form?",
-            reply_markup=ReplyKeyboardMarkup(
-                reply_keyboard, one_time_keyboard=True
-            ),
+            reply_markup=FILL_METHOD_KEYBOARD,
         )
         return CHOOSING_FILL_METHOD
     
     # Parse the custom mappings
     lines = text.strip().split('\n')
-    custom_mappings = context.user_data.get('field_mappings', {}).copy()
+    custom_mappings = session.field_mappings.copy()
     
     updated = False
     for line in lines:
@@ -232,13 +338,12 @@ async def process_field_customization(update: Update, context: ContextTypes.DEFA
     
     if updated:
         # Update the mappings
-        context.user_data['field_mappings'] = custom_mappings
+        session.field_mappings = custom_mappings
         
-        message = "Field names updated! New mappings:\n\n"
-        for field, display_name in custom_mappings.items():
-            message += f"{field} → {display_name}\n"
+        parts = ["Field names updated! New mappings:\n\n"]
+        parts.extend(f"{field} → {display_name}\n" for field, display_name in custom_mappings.items())
         
-        await update.message.reply_text(message)
+        await reply_in_chunks(update.message, parts)
     else:
         await update.message.reply_text(
             "No valid mappings found. Please use the format 'field_name: New Display Name' or type 'skip'."
@@ -246,227 +351,616 @@ async def process_field_customization(update: Update, context: ContextTypes.DEFA
         return CUSTOMIZING_FIELDS
     
     # Now move to filling method choice
-    reply_keyboard = [["Fill Fields One-by-One"], ["Fill All Fields at Once"]]
-    
     await update.message.reply_text(
         f"How would you like to fill this form?",
-        reply_markup=ReplyKeyboardMarkup(
-            reply_keyboard, one_time_keyboard=True
-        ),
+        reply_markup=FILL_METHOD_KEYBOARD,
     )
     return CHOOSING_FILL_METHOD
 
+# Cached Google credentials, loaded on first use and shared for the process lifetime
+_credentials = None
+_credentials_lock = threading.Lock()
+
+# Drive clients are not thread-safe, so each worker thread keeps its own
+_drive_local = threading.local()
+
+# Bumped by reset_drive_service() to invalidate the clients cached in every thread
+_drive_generation = 0
+
+# Drive v3 discovery document bundled with google-api-python-client, read once
+_drive_discovery_doc = None
+
+def _load_credentials():
+    """Load the service account credentials, caching them after the first success"""
+    global _credentials
+    if _credentials is not None:
+        return _credentials
+    
+    with _credentials_lock:
+        if _credentials is None:
+            if not os.path.exists(CREDENTIALS_FILE):
+                logger.warning("Google credentials file not found: %s", CREDENTIALS_FILE)
+                return None
+            _credentials = Credentials.from_service_account_file(CREDENTIALS_FILE, scopes=SCOPES)
+        return _credentials
+
+def _get_drive_discovery_doc():
+    """Return the bundled Drive v3 discovery document, reading it on first use"""
+    global _drive_discovery_doc
+    if _drive_discovery_doc is None:
+        _drive_discovery_doc = get_static_doc('drive', 'v3')
+    return _drive_discovery_doc
+
 def setup_google_services():
-    """Set up Google Drive client with credentials"""
+    """Set up Google Drive client with credentials
+    
+    Credentials are read from disk once, and the Drive client is built once
+    per thread and reused afterwards. Failures are not cached, so a missing
+    credentials file can be fixed without restarting the bot.
+    """
+    generation = _drive_generation
+    cached = getattr(_drive_local, 'drive_service', None)
+    if cached is not None and cached[0] == generation:
+        return cached[1]
+    
     try:
-        if not os.path.exists(CREDENTIALS_FILE):
-            logger.warning(f"Google credentials file not found: {CREDENTIALS_FILE}")
+        creds = _load_credentials()
+        if not creds:
             return None
             
-        creds = Credentials.from_service_account_file(CREDENTIALS_FILE, scopes=SCOPES)
-        drive_service = build('drive', 'v3', credentials=creds)
+        # Build from the bundled discovery document so no discovery fetch or cache lookup happens
+        discovery_doc = _get_drive_discovery_doc()
+        if discovery_doc:
+            drive_service = build_from_document(discovery_doc, credentials=creds)
+        else:
+            drive_service = build('drive', 'v3', credentials=creds, cache_discovery=False)
+        _drive_local.drive_service = (generation, drive_service)
         return drive_service
     except Exception as e:
-        logger.error(f"Error setting up Google services: {e}")
+        logger.error("Error setting up Google services: %s", e)
         return None
 
-def list_pdf_templates():
-    """List all PDF forms in Google Drive"""
+def reset_drive_service():
+    """Drop the cached credentials and Drive clients so they are rebuilt on next use
+    
+    Useful after rotating the credentials file without restarting the bot.
+    """
+    global _credentials, _drive_generation
+    with _credentials_lock:
+        _credentials = None
+        _drive_generation += 1
+
+# Cached template listing as (expires_at, templates, templates_by_name)
+_template_list_cache = (0.0, [], {})
+
+def _list_templates_indexed(force_refresh=False):
+    """List all PDF forms in Google Drive along with a name -> template index
+    
+    The listing is cached for TEMPLATE_LIST_TTL seconds since the template
+    set rarely changes between user interactions.
+    """
+    global _template_list_cache
+    expires_at, templates, templates_by_name = _template_list_cache
+    if templates and not force_refresh and time.monotonic() < expires_at:
+        return templates, templates_by_name
+    
     try:
         drive_service = setup_google_services()
         if not drive_service:
-            return []
+            return [], {}
+            
+        # Search for non-trashed PDF files, fetching as many as possible per page
+        query = "mimeType='application/pdf' and trashed=false"
+        templates = []
+        page_token = None
+        while True:
+            results = drive_service.files().list(
+                q=query, 
+                spaces='drive',
+                pageSize=1000,
+                orderBy='name',
+                pageToken=page_token,
+                fields='nextPageToken, files(id, name, modifiedTime, md5Checksum, size)'
+            ).execute(num_retries=DRIVE_NUM_RETRIES)
             
-        # Search for PDF files
-        query = "mimeType='application/pdf'"
-        results = drive_service.files().list(
-            q=query, 
-            spaces='drive',
-            fields='files(id, name)'
-        ).execute()
+            templates.extend(results.get('files', []))
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                break
         
-        templates = results.get('files', [])
-        return templates
+        # Index by name, the first of any duplicate names wins as it is listed first
+        templates_by_name = {}
+        for template in templates:
+            templates_by_name.setdefault(template['name'], template)
+        
+        # Don't cache an empty listing so newly uploaded templates show up right away
+        if templates:
+            _template_list_cache = (time.monotonic() + TEMPLATE_LIST_TTL, templates, templates_by_name)
+        return templates, templates_by_name
     except Exception as e:
-        logger.error(f"Error listing PDF templates: {e}")
-        return []
+        logger.error("Error listing PDF templates: %s", e)
+        return [], {}
+
+def list_pdf_templates():
+    """List all PDF forms in Google Drive"""
+    return _list_templates_indexed()[0]
+
+# time.monotonic() of the last listing refresh forced by find_template
+_last_miss_refresh = float('-inf')
+
+def find_template(template_name):
+    """Find a PDF form in Google Drive by name, returning None if there is none
+    
+    A name missing from the cached listing triggers a fresh listing, so a
+    template uploaded since the last listing is still found. Those refreshes
+    are limited to one per TEMPLATE_MISS_REFRESH_INTERVAL so that mistyped
+    names can't make every message relist Drive.
+    """
+    global _last_miss_refresh
+    _, templates_by_name = _list_templates_indexed()
+    template = templates_by_name.get(template_name)
+    now = time.monotonic()
+    if template is None and now - _last_miss_refresh >= TEMPLATE_MISS_REFRESH_INTERVAL:
+        _last_miss_refresh = now
+        _, templates_by_name = _list_templates_indexed(force_refresh=True)
+        template = templates_by_name.get(template_name)
+    return template
+
+# Long-lived pool so each worker keeps its thread-local Drive client between downloads
+_download_executor = ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS, thread_name_prefix='drive-download')
+
+def _download_byte_range(template_id, start, end, buffer):
+    """Download bytes start..end (inclusive) of a Drive file into a preallocated buffer"""
+    drive_service = setup_google_services()
+    if not drive_service:
+        raise RuntimeError("Google Drive service is not available")
+    
+    request = drive_service.files().get_media(fileId=template_id)
+    request.headers['range'] = f"bytes={start}-{end}"
+    content = request.execute(num_retries=DRIVE_NUM_RETRIES)
+    
+    if len(content) != end - start + 1:
+        raise IOError(f"Expected {end - start + 1} bytes for range {start}-{end}, got {len(content)}")
+    
+    # Ranges are disjoint, so workers can write into the buffer without locking
+    buffer[start:end + 1] = content
 
-def download_template_from_drive(template_id):
-    """Download a PDF form from Google Drive"""
+def download_template_from_drive(template_id, size=None):
+    """Download a PDF form from Google Drive
+    
+    Args:
+        template_id: The Drive file ID of the template
+        size: The file size in bytes, as reported by list_pdf_templates
+    
+    Large files are fetched as DOWNLOAD_WORKERS concurrent byte ranges, so
+    the download takes roughly one round-trip instead of one per chunk.
+    """
     try:
         drive_service = setup_google_services()
         if not drive_service:
             return None
             
-        # Get file metadata
-        file = drive_service.files().get(fileId=template_id).execute()
+        # The listing already carries the size, so no metadata request is needed
+        size = int(size or 0)
+        
+        if size > DOWNLOAD_CHUNK_SIZE:
+            buffer = bytearray(size)
+            range_size = -(-size // DOWNLOAD_WORKERS)
+            futures = [
+                _download_executor.submit(
+                    _download_byte_range, template_id, start, min(start + range_size, size) - 1, buffer
+                )
+                for start in range(0, size, range_size)
+            ]
+            for future in futures:
+                future.result()
+            return io.BytesIO(buffer)
+        
+        request = drive_service.files().get_media(fileId=template_id)
+        
+        # A small file of known size comes back whole from a single request
+        if size:
+            return io.BytesIO(request.execute(num_retries=DRIVE_NUM_RETRIES))
         
         # Create a BytesIO object to store the downloaded file
         file_content = io.BytesIO()
         
-        # Download the file
-        request = drive_service.files().get_media(fileId=template_id)
+        # Size unknown, so let the downloader work out the total from the response
         downloader = MediaIoBaseDownload(file_content, request)
         
         done = False
         while not done:
-            status, done = downloader.next_chunk()
+            status, done = downloader.next_chunk(num_retries=DRIVE_NUM_RETRIES)
             
         file_content.seek(0)
         return file_content
     except Exception as e:
-        logger.error(f"Error downloading template: {e}")
+        logger.error("Error downloading template: %s", e)
+        return None
+
+# PDF names compared when scanning form annotations
+_WIDGET = pikepdf.Name.Widget
+_BUTTON = pikepdf.Name.Btn
+_OFF = pikepdf.Name.Off
+
+def _qualified_field_name(field, parent_names):
+    """Build the fully qualified name of a form field from its /Parent chain
+    
+    Sibling widgets share their ancestors, so the qualified names of parent
+    fields are memoized in parent_names, keyed by object number.
+    """
+    prefix = ''
+    parent = field.get('/Parent')
+    if parent is not None:
+        key = parent.objgen if parent.is_indirect else None
+        prefix = parent_names.get(key) if key else None
+        if prefix is None:
+            prefix = _qualified_field_name(parent, parent_names)
+            if key:
+                parent_names[key] = prefix
+    
+    name = field.get('/T')
+    if name is None:
+        return prefix
+    name = str(name)
+    return f"{prefix}.{name}" if prefix else name
+
+def _field_type(field):
+    """Return the /FT of a form field, which may be inherited from an ancestor"""
+    while field is not None:
+        field_type = field.get('/FT')
+        if field_type is not None:
+            return field_type
+        field = field.get('/Parent')
+    return None
+
+def _on_state(widget):
+    """Return the appearance state a checkbox/radio widget shows when selected"""
+    appearances = widget.get('/AP')
+    normal = appearances.get('/N') if appearances is not None else None
+    if isinstance(normal, pikepdf.Dictionary):
+        for state in normal.keys():
+            if state != '/Off':
+                return state
+    # Without appearance streams there is no state to match, so use the usual checkbox one
+    return '/Yes'
+
+def _match_button_state(value, on_states):
+    """Return the appearance state a typed checkbox/radio value selects, or None if it selects none"""
+    wanted = value.strip().lstrip('/').lower()
+    if wanted == 'off':
+        return '/Off'
+    for on_state in on_states:
+        if on_state[1:].lower() == wanted:
+            return on_state
+    return None
+
+def button_choices(field_index, field_name):
+    """Return the values a checkbox/radio field accepts, or None for other fields"""
+    on_states = dict.fromkeys(
+        on_state for *_, on_state in (field_index or {}).get(field_name, ()) if on_state is not None
+    )
+    if not on_states:
         return None
+    return [state[1:] for state in on_states] + ['Off']
+
+def match_button_choice(value, choices):
+    """Return the button_choices entry a typed value selects, or None if it selects none"""
+    state = _match_button_state(value, [f'/{choice}' for choice in choices])
+    return state[1:] if state else None
+
+def build_field_index(pdf):
+    """Map form field names to the positions of their widget annotations
+    
+    Args:
+        pdf: An open pikepdf.Pdf holding the template pages
+        
+    Returns:
+        A dict of {field_name: [(page_number, annotation_number, is_kid, on_state), ...]},
+        where is_kid marks widgets whose value lives on their /Parent field
+        and on_state is the selected appearance state of checkbox/radio
+        widgets (None for other fields)
+    """
+    field_index = {}
+    parent_names = {}
+    for page_number, page in enumerate(pdf.pages):
+        annotations = page.obj.get('/Annots')
+        if annotations is None:
+            continue
+        for annotation_number, annotation in enumerate(annotations):
+            if annotation.get('/Subtype') != _WIDGET:
+                continue
+            field_name = _qualified_field_name(annotation, parent_names)
+            if field_name:
+                # Widgets without a /T are kids of the field that holds the value
+                is_kid = '/T' not in annotation
+                on_state = _on_state(annotation) if _field_type(annotation) == _BUTTON else None
+                field_index.setdefault(field_name, []).append((page_number, annotation_number, is_kid, on_state))
+    return field_index
 
 def extract_form_fields(template_content):
-    """Extract form fields from a PDF template"""
+    """Extract form fields from a PDF template
+    
+    Returns:
+        A (fields, field_index) tuple, where field_index is the
+        build_field_index result used by generate_pdf
+    """
     try:
-        # Create a temporary file for the template
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_file:
-            temp_file.write(template_content.getvalue())
-            temp_path = temp_file.name
-        
-        # Read the template using PyPDF2
-        template_pdf = PdfReader(temp_path)
+        # Read the template straight from memory using pikepdf
+        with pikepdf.open(template_content) as template_pdf:
+            # Index the widget annotations so filling doesn't need to rescan every page
+            field_index = build_field_index(template_pdf)
         
-        # Extract fields
-        fields = []
-        form_fields = template_pdf.get_fields()
+        # The fillable fields are the indexed ones, in document order
+        fields = list(field_index)
         
-        if form_fields:
-            # Add all field names to our list
-            fields = list(form_fields.keys())
-            logger.info(f"Found {len(fields)} form fields in the PDF")
+        if fields:
+            logger.info("Found %d form fields in the PDF", len(fields))
         else:
             logger.warning("No form fields found in the PDF")
         
-        # Remove the temporary file
-        os.remove(temp_path)
-        
-        return fields
+        return fields, field_index
     except Exception as e:
-        logger.error(f"Error extracting form fields: {e}")
-        return []
+        logger.error("Error extracting form fields: %s", e)
+        return [], {}
 
-def generate_pdf(form_data, template_content, output_path):
-    """Generate filled PDF from template and form data"""
+def generate_pdf(form_data, template_content, output, field_index=None):
+    """Generate filled PDF from template and form data
+    
+    Args:
+        form_data: Dict of {field_name: value} to fill in
+        template_content: BytesIO with the template PDF
+        output: File path or writable binary stream for the filled PDF
+        field_index: Optional build_field_index result for the template;
+            built from the template when not provided
+    """
     try:
-        # Create a temporary file for the template
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_file:
-            temp_file.write(template_content.getvalue())
-            temp_path = temp_file.name
-
-        # Read the template using PyPDF2
-        template_pdf = PdfReader(temp_path)
-        
-        # Create a PDF writer
-        writer = PdfWriter()
-        
-        # Add all pages from the template
-        for page_num in range(len(template_pdf.pages)):
-            writer.add_page(template_pdf.pages[page_num])
-        
-        # Update form fields with data
-        # In PyPDF2 v3.x, update_page_form_field_values takes the pages to update
-        # and the fields dictionary
-        writer.update_page_form_field_values(writer.pages, form_data)
-        
-        # Set the "need appearances" flag to ensure form fields are visible
-        try:
-            writer._root_object['/AcroForm'].update({
-                '/NeedAppearances': True
-            })
-        except Exception as e:
-            logger.warning(f"Could not set NeedAppearances flag: {e}")
-        
-        # Write the filled PDF
-        with open(output_path, "wb") as output_file:
-            writer.write(output_file)
+        # Open the template with pikepdf and fill it in place
+        with pikepdf.open(template_content) as pdf:
+            if field_index is None:
+                field_index = build_field_index(pdf)
+            
+            # Update only the annotations of the filled fields
+            pages = pdf.pages
+            page_annotations = {}
+            for field_name, value in form_data.items():
+                positions = field_index.get(field_name)
+                if not positions:
+                    continue
+                
+                # Checkbox and radio values have to select one of the widgets' appearance states
+                on_states = [on_state for *_, on_state in positions if on_state is not None]
+                if on_states:
+                    button_state = _match_button_state(value, on_states)
+                    if button_state is None:
+                        logger.warning("Ignoring value %r for field %s, expected one of %s", value, field_name, on_states)
+                        continue
+                    button_value = pikepdf.Name(button_state)
+                
+                # Build the value objects once per field, not once per widget
+                text_value = pikepdf.String(value)
+                
+                for page_number, annotation_number, is_kid, on_state in positions:
+                    annotations = page_annotations.get(page_number)
+                    if annotations is None:
+                        annotations = page_annotations[page_number] = pages[page_number].obj.Annots
+                    annotation = annotations[annotation_number]
+                    field = annotation.Parent if is_kid else annotation
+                    if on_state is not None:
+                        # Only the widget showing the selected state is switched on, radio siblings go off
+                        field.V = button_value
+                        annotation.AS = button_value if on_state == button_state else _OFF
+                    else:
+                        field.V = text_value
+            
+            # Set the "need appearances" flag to ensure form fields are visible
+            try:
+                pdf.Root.AcroForm.NeedAppearances = True
+            except Exception as e:
+                logger.warning("Could not set NeedAppearances flag: %s", e)
+            
+            # Write the filled PDF
+            pdf.save(output)
         
-        # Remove the temporary file
-        os.remove(temp_path)
+        logger.info("Successfully generated PDF with %d filled fields", len(form_data))
+        return True
+    except Exception as e:
+        logger.error("Error generating PDF: %s", e)
+        return False
+
+# Downloaded templates keyed by (template_id, modifiedTime, md5Checksum) -> (fields, field_index, template_bytes)
+_template_cache = OrderedDict()
+
+# Template loads in progress, keyed like _template_cache, so concurrent requests share one download
+_template_loads = {}
+
+async def _fetch_template(template, cache_key):
+    """Download a template, extract its form fields and cache the result
+    
+    Returns:
+        A (template_bytes, fields, field_index) tuple; template_bytes is None
+        if the download failed
+    """
+    template_content = await asyncio.to_thread(
+        download_template_from_drive, template['id'], template.get('size')
+    )
+    if not template_content:
+        return None, [], {}
+    
+    fields, field_index = await asyncio.to_thread(extract_form_fields, template_content)
+    template_bytes = template_content.getvalue()
+    
+    # Only cache when Drive reported a revision, so edited templates are picked up
+    if fields and cache_key[1]:
+        _template_cache[cache_key] = (tuple(fields), field_index, template_bytes)
+        if len(_template_cache) > TEMPLATE_CACHE_SIZE:
+            _template_cache.popitem(last=False)
+    
+    return template_bytes, fields, field_index
+
+async def load_template(template):
+    """Download a template and extract its form fields, reusing cached results
+    
+    Args:
+        template: A template entry from list_pdf_templates
         
-        logger.info(f"Successfully generated PDF at {output_path}")
+    Returns:
+        A (template_content, fields, field_index) tuple; template_content is
+        None if the download failed and fields is empty if the PDF has no
+        form fields
+    """
+    cache_key = (template['id'], template.get('modifiedTime'), template.get('md5Checksum'))
+    
+    cached = _template_cache.get(cache_key)
+    if cached is not None:
+        _template_cache.move_to_end(cache_key)
+        fields, field_index, template_bytes = cached
+        return io.BytesIO(template_bytes), list(fields), field_index
+    
+    # Join a download of the same template that another chat already started
+    task = _template_loads.get(cache_key)
+    if task is None:
+        task = asyncio.ensure_future(_fetch_template(template, cache_key))
+        _template_loads[cache_key] = task
+        task.add_done_callback(lambda _: _template_loads.pop(cache_key, None))
+    
+    # Shield the shared load so one cancelled waiter doesn't cancel it for the others
+    template_bytes, fields, field_index = await asyncio.shield(task)
+    if template_bytes is None:
+        return None, [], {}
+    
+    # Each caller gets its own stream and field list over the shared results
+    return io.BytesIO(template_bytes), list(fields), field_index
+
+def save_pdf_bytes(pdf_path, pdf_bytes):
+    """Write PDF bytes to disk, returning True on success"""
+    try:
+        with open(pdf_path, 'wb') as pdf_file:
+            pdf_file.write(pdf_bytes)
         return True
     except Exception as e:
-        logger.error(f"Error generating PDF: {e}")
+        logger.error("Error saving PDF: %s", e)
         return False
 
+def read_pdf_bytes(pdf_path):
+    """Read a PDF file from disk"""
+    with open(pdf_path, 'rb') as pdf_file:
+        return pdf_file.read()
+
 class PDFStorage:
     def __init__(self, storage_dir='user_pdfs'):
         self.storage_dir = storage_dir
-        self.index_file = os.path.join(storage_dir, 'pdf_index.json')
+        self.index_file = os.path.join(storage_dir, 'pdf_index.db')
         os.makedirs(storage_dir, exist_ok=True)
-        self.load_index()
-
-    def load_index(self):
-        """Load the PDF index from file"""
-        try:
-            if os.path.exists(self.index_file):
-                with open(self.index_file, 'r') as f:
-                    self.index = json.load(f)
-            else:
-                self.index = {}
-        except Exception as e:
-            logger.error(f"Error loading PDF index: {e}")
-            self.index = {}
+        # The connection is shared by worker threads, one statement at a time
+        self._lock = threading.Lock()
+        self.open_index()
 
-    def save_index(self):
-        """Save the PDF index to file"""
-        try:
-            with open(self.index_file, 'w') as f:
-                json.dump(self.index, f)
-        except Exception as e:
-            logger.error(f"Error saving PDF index: {e}")
+    def open_index(self):
+        """Open the SQLite PDF index, creating the table if needed"""
+        self.db = sqlite3.connect(self.index_file, check_same_thread=False)
+        # WAL lets lookups run while a write is in progress
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        with self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS pdfs ("
+                "user_id INTEGER, path TEXT, filename TEXT, created_at REAL, expires_at REAL, "
+                "PRIMARY KEY (user_id, path))"
+            )
+            self.db.execute("CREATE INDEX IF NOT EXISTS pdfs_expires_at ON pdfs (expires_at)")
 
     def store_pdf(self, user_id: int, pdf_path: str, filename: str):
         """Store PDF information for a user"""
-        if str(user_id) not in self.index:
-            self.index[str(user_id)] = []
-
-        # Add new PDF info
-        pdf_info = {
-            'path': pdf_path,
-            'filename': filename,
-            'timestamp': datetime.now().isoformat(),
-            'expires_at': (datetime.now() + timedelta(days=7)).isoformat()  # Keep PDFs for 7 days
-        }
-        
-        self.index[str(user_id)].append(pdf_info)
-        self.save_index()
+        now = time.time()
+        try:
+            with self._lock, self.db:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO pdfs VALUES (?, ?, ?, ?, ?)",
+                    (user_id, pdf_path, filename, now, now + PDF_RETENTION_SECONDS),
+                )
+        except sqlite3.Error as e:
+            logger.error("Error storing PDF info: %s", e)
 
     def get_user_pdfs(self, user_id: int):
-        """Get all PDFs for a user"""
-        return self.index.get(str(user_id), [])
+        """Get all unexpired PDFs for a user"""
+        with self._lock:
+            rows = self.db.execute(
+                "SELECT path, filename, created_at, expires_at FROM pdfs "
+                "WHERE user_id = ? AND expires_at > ? ORDER BY created_at",
+                (user_id, time.time()),
+            ).fetchall()
+        return [
+            {'path': path, 'filename': filename, 'timestamp': created_at, 'expires_at': expires_at}
+            for path, filename, created_at, expires_at in rows
+        ]
 
     def cleanup_old_pdfs(self):
         """Remove expired PDFs"""
-        now = datetime.now()
-        for user_id in list(self.index.keys()):
-            pdfs = self.index[user_id]
-            valid_pdfs = []
-            
-            for pdf in pdfs:
-                expires_at = datetime.fromisoformat(pdf['expires_at'])
-                if expires_at > now:
-                    valid_pdfs.append(pdf)
-                else:
-                    # Remove the actual PDF file
-                    try:
-                        if os.path.exists(pdf['path']):
-                            os.remove(pdf['path'])
-                    except Exception as e:
-                        logger.error(f"Error removing old PDF: {e}")
-
-            if valid_pdfs:
-                self.index[user_id] = valid_pdfs
-            else:
-                del self.index[user_id]
+        self._remove_pdfs("expires_at <= ?", (time.time(),))
+
+    def evict_excess_pdfs(self):
+        """Remove the oldest PDFs beyond MAX_RETAINED_PDFS"""
+        self._remove_pdfs(
+            "rowid NOT IN (SELECT rowid FROM pdfs ORDER BY created_at DESC LIMIT ?)",
+            (MAX_RETAINED_PDFS,),
+        )
+
+    def _remove_pdfs(self, condition, params):
+        """Delete the PDFs matching an SQL condition from the index and from disk"""
+        try:
+            with self._lock, self.db:
+                stale = self.db.execute(f"SELECT path FROM pdfs WHERE {condition}", params).fetchall()
+                if not stale:
+                    return
+                self.db.execute(f"DELETE FROM pdfs WHERE {condition}", params)
+        except sqlite3.Error as e:
+            logger.error("Error cleaning up PDF index: %s", e)
+            return
         
-        self.save_index()
+        for (pdf_path,) in stale:
+            # Remove the actual PDF file, which may already be gone
+            try:
+                with suppress(FileNotFoundError):
+                    os.unlink(pdf_path)
+            except Exception as e:
+                logger.error("Error removing old PDF: %s", e)
 
-# Initialize PDF storage
+# Initialize PDF storage and create the output directory for generated PDFs
 pdf_storage = PDFStorage()
+os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+def save_generated_pdf(user_id, pdf_path, filename, pdf_bytes):
+    """Save a generated PDF and record it so cleanup can expire it, returning True on success"""
+    if not save_pdf_bytes(pdf_path, pdf_bytes):
+        return False
+    pdf_storage.store_pdf(user_id, pdf_path, filename)
+    # Keep the number of PDFs on disk bounded between the periodic cleanups
+    pdf_storage.evict_excess_pdfs()
+    return True
+
+async def cleanup_pdfs(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Periodic job removing expired generated PDFs, run in a worker thread"""
+    await asyncio.to_thread(pdf_storage.cleanup_old_pdfs)
+
+async def reply_in_chunks(message, parts, parse_mode=None):
+    """Reply with the given text parts, packing as many as fit into each Telegram message
+    
+    Parts are never split, so a chunk boundary can't fall in the middle of a line
+    (or of a formatting entity, when each part is formatted on its own).
+    """
+    chunk = []
+    chunk_length = 0
+    for part in parts:
+        if chunk and chunk_length + len(part) > MessageLimit.MAX_TEXT_LENGTH:
+            await message.reply_text("".join(chunk), parse_mode=parse_mode)
+            chunk = []
+            chunk_length = 0
+        chunk.append(part)
+        chunk_length += len(part)
+    
+    if chunk:
+        await message.reply_text("".join(chunk), parse_mode=parse_mode)
 
 # Command handlers
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -494,7 +988,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 async def form(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Start the PDF filling process by offering form selection"""
     # Get available forms from Google Drive
-    templates = list_pdf_templates()
+    templates = await asyncio.to_thread(list_pdf_templates)
     
     if not templates:
         await update.message.reply_text(
@@ -502,7 +996,8 @@ async def form(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         )
         return ConversationHandler.END
     
-    context.user_data['templates'] = templates
+    # Start a fresh session for the new form
+    context.user_data['session'] = FormSession()
     
     # Create keyboard with form options
     reply_keyboard = [[template['name']] for template in templates]
@@ -516,62 +1011,56 @@ async def form(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     
     return SELECTING_TEMPLATE
 
+# Characters replaced in template names when building output filenames
+_UNSAFE_FILENAME_CHARS = re.compile(r'[^\w.-]')
+
 async def template_selection(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handle template selection and extract fields"""
     template_name = update.message.text
+    session = get_session(context)
     
-    # Check if the selected template exists in our data
-    if 'templates' not in context.user_data or template_name not in [t['name'] for t in context.user_data['templates']]:
+    # Look up the selected template
+    selected_template = await asyncio.to_thread(find_template, template_name)
+    if not selected_template:
         await update.message.reply_text(
             "Sorry, I couldn't find that template. Please select a template from the list.",
-            reply_markup=ReplyKeyboardRemove(),
-        )
-        return ConversationHandler.END
-    
-    # Get the template ID
-    template_id = None
-    for template in context.user_data['templates']:
-        if template['name'] == template_name:
-            template_id = template['id']
-            break
-    
-    if not template_id:
-        await update.message.reply_text(
-            "Sorry, I couldn't find the ID for that template. Please try again.",
-            reply_markup=ReplyKeyboardRemove(),
+            reply_markup=REMOVE_KEYBOARD,
         )
         return ConversationHandler.END
+    template_id = selected_template['id']
     
-    # Download the template and extract fields
+    # Download the template and extract fields, starting before the progress message is sent
+    load_task = asyncio.create_task(load_template(selected_template))
     await update.message.reply_text(
         f"Downloading template: {template_name}...",
-        reply_markup=ReplyKeyboardRemove(),
+        reply_markup=REMOVE_KEYBOARD,
     )
     
     try:
-        # Download the PDF template
-        template_content = download_template_from_drive(template_id)
+        # Wait for the PDF template and its form fields
+        template_content, fields, field_index = await load_task
         if not template_content:
             await update.message.reply_text(
                 "Sorry, I couldn't download that template. Please try again or choose a different template.",
-                reply_markup=ReplyKeyboardRemove(),
+                reply_markup=REMOVE_KEYBOARD,
             )
             return ConversationHandler.END
         
-        # Extract form fields
-        fields = extract_form_fields(template_content)
         if not fields:
             await update.message.reply_text(
                 "This PDF doesn't appear to have any fillable fields. Please choose a fillable PDF template.",
-                reply_markup=ReplyKeyboardRemove(),
+                reply_markup=REMOVE_KEYBOARD,
             )
             return ConversationHandler.END
         
-        # Save form details in user_data
-        context.user_data['template_id'] = template_id
-        context.user_data['template_name'] = template_name
-        context.user_data['fields'] = fields
-        context.user_data['template'] = template_content
+        # Save form details in the session
+        session.template_id = template_id
+        session.template_name = template_name
+        session.safe_template_name = _UNSAFE_FILENAME_CHARS.sub('_', template_name)
+        session.fields = fields
+        session.remaining = set(fields)
+        session.template = template_content
+        session.field_index = field_index
         
         # Check if we have template-specific mappings for this template
         has_template_mappings = template_id in TEMPLATE_FIELD_MAPPINGS
@@ -581,81 +1070,100 @@ async def template_selection(update: Update, context: ContextTypes.DEFAULT_TYPE)
         
         # If we have template-specific mappings, skip the customization step
         if has_template_mappings:
-            field_mappings = context.user_data.get('field_mappings', {})
+            field_mappings = session.field_mappings
             
             # Show the mappings that will be used
-            message = f"Using predefined field mappings for this template:\n\n"
-            for field, display_name in field_mappings.items():
-                message += f"{field} → {display_name}\n"
+            parts = ["Using predefined field mappings for this template:\n\n"]
+            parts.extend(f"{field} → {display_name}\n" for field, display_name in field_mappings.items())
             
-            await update.message.reply_text(message)
+            await reply_in_chunks(update.message, parts)
             
             # Go directly to filling method choice
-            reply_keyboard = [["Fill Fields One-by-One"], ["Fill All Fields at Once"]]
             await update.message.reply_text(
                 f"How would you like to fill this form?",
-                reply_markup=ReplyKeyboardMarkup(
-                    reply_keyboard, one_time_keyboard=True
-                ),
+                reply_markup=FILL_METHOD_KEYBOARD,
             )
             return CHOOSING_FILL_METHOD
         else:
             # Ask if user wants to customize field names
-            reply_keyboard = [['Customize Field Names'], ['Use Default Names']]
             await update.message.reply_text(
                 f"I found {len(fields)} fillable fields in this form.\n\n"
                 "Would you like to customize the field names or use the default names?",
-                reply_markup=ReplyKeyboardMarkup(
-                    reply_keyboard, one_time_keyboard=True, input_field_placeholder="Choose an option"
-                ),
+                reply_markup=FIELD_NAMING_KEYBOARD,
             )
             return CHOOSING_FIELD_NAMES
         
     except Exception as e:
-        logger.error(f"Error processing template: {e}")
+        logger.error("Error processing template: %s", e)
         await update.message.reply_text(
             "Sorry, there was an error processing your template. Please try again.",
-            reply_markup=ReplyKeyboardRemove(),
+            reply_markup=REMOVE_KEYBOARD,
         )
         return ConversationHandler.END
 
 async def choose_field_naming(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handle the user's choice for field naming"""
     choice = update.message.text
+    session = get_session(context)
     
     if choice == "Customize Field Names":
         # Go to field name customization
         return await customize_field_names(update, context)
     else:
         # Skip to filling method choice
-        fields = context.user_data['fields']
+        fields = session.fields
         # Create default mappings
         create_custom_field_mapping(update, context)
         
-        reply_keyboard = [["Fill Fields One-by-One"], ["Fill All Fields at Once"]]
-        
         await update.message.reply_text(
             f"Using default field names. How would you like to fill this form?",
-            reply_markup=ReplyKeyboardMarkup(
-                reply_keyboard, one_time_keyboard=True
-            ),
+            reply_markup=FILL_METHOD_KEYBOARD,
         )
         return CHOOSING_FILL_METHOD
 
+async def send_bulk_template(message, fields, field_mappings, field_index, heading):
+    """Send the template the user fills in to enter values for all the given fields at once"""
+    parts = [heading]
+    
+    # Add each field to the template with a clear format, using the custom mapping or default display name
+    parts.extend(f"{field_mappings.get(field) or get_display_name(field)}: [Enter value here]\n" for field in fields)
+    parts.append("\nReplace '[Enter value here]' with your actual values, keeping the field names intact.")
+    
+    # Checkboxes and radio buttons only accept their own states
+    choice_lines = []
+    for field in fields:
+        choices = button_choices(field_index, field)
+        if choices:
+            choice_lines.append(f"{field_mappings.get(field) or get_display_name(field)}: {' / '.join(choices)}\n")
+    if choice_lines:
+        parts.append("\n\nThese fields accept only the listed values:\n")
+        parts.extend(choice_lines)
+    
+    # The filled-in template has to come back as one message, so it is sent as one
+    await message.reply_text(
+        "".join(parts),
+        reply_markup=REMOVE_KEYBOARD,
+    )
+
 async def choose_fill_method(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handle the user's choice of fill method"""
     text = update.message.text
+    session = get_session(context)
     
     if text == "Fill Fields One-by-One":
         # Create keyboard with field options for individual filling
-        fields = context.user_data['fields']
-        field_mappings = context.user_data.get('field_mappings', {})
+        fields = session.fields
+        field_mappings = session.field_mappings
         
-        # Create a keyboard with display names
-        reply_keyboard = []
-        for field in fields:
-            display_name = field_mappings.get(field, get_display_name(field))
-            reply_keyboard.append([display_name])
+        # Create a keyboard with display names, kept so later turns only filter it
+        reply_keyboard = [[field_mappings.get(field) or get_display_name(field)] for field in fields]
+        session.field_keyboard_rows = reply_keyboard
+        
+        # Map display names back to fields, so each choice is a single lookup
+        field_by_display_name = {}
+        for field, (display_name,) in zip(fields, reply_keyboard):
+            field_by_display_name.setdefault(display_name, field)
+        session.field_by_display_name = field_by_display_name
         
         await update.message.reply_text(
             "Please choose a field to fill:",
@@ -667,169 +1175,129 @@ async def choose_fill_method(update: Update, context: ContextTypes.DEFAULT_TYPE)
         
     elif text == "Fill All Fields at Once":
         # Provide a template for bulk filling
-        fields = context.user_data['fields']
-        field_mappings = context.user_data.get('field_mappings', {})
-        
-        # Create a template for the user to fill
-        template_text = "Please fill in values for all fields below:\n\n"
-        
-        # Add each field to the template with a clear format
-        for field in fields:
-            # Use the custom mapping or default display name
-            display_name = field_mappings.get(field, get_display_name(field))
-            template_text += f"{display_name}: [Enter value here]\n"
-            
-        template_text += "\nReplace '[Enter value here]' with your actual values, keeping the field names intact."
-        
-        await update.message.reply_text(
-            template_text,
-            reply_markup=ReplyKeyboardRemove(),
+        await send_bulk_template(
+            update.message, session.fields, session.field_mappings, session.field_index,
+            "Please fill in values for all fields below:\n\n",
         )
-        
         return BULK_ENTRY
 
 async def regular_choice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Ask the user for info about the selected field."""
     display_name = update.message.text
-    fields = context.user_data['fields']
-    field_mappings = context.user_data.get('field_mappings', {})
+    session = get_session(context)
     
     # Find the actual field name from the display name
-    field_name = None
-    for field in fields:
-        if field_mappings.get(field, get_display_name(field)) == display_name:
-            field_name = field
-            break
+    field_name = session.field_by_display_name.get(display_name)
     
     if not field_name:
         await update.message.reply_text(
             f"Could not find field for '{display_name}'. Please try again.",
-            reply_markup=ReplyKeyboardRemove(),
+            reply_markup=REMOVE_KEYBOARD,
         )
         return ConversationHandler.END
     
     # Store the actual field name in context
-    context.user_data['choice'] = field_name
+    session.choice = field_name
+    
+    # Checkboxes and radio buttons get their accepted values as buttons
+    choices = button_choices(session.field_index, field_name)
+    if choices:
+        await update.message.reply_text(
+            f"Please choose the value for field '{display_name}':",
+            reply_markup=ReplyKeyboardMarkup([[choice] for choice in choices], one_time_keyboard=True),
+        )
+        return TYPING_REPLY
     
     await update.message.reply_text(
         f"Please enter the value for field '{display_name}':",
-        reply_markup=ReplyKeyboardRemove(),
+        reply_markup=REMOVE_KEYBOARD,
     )
     
     return TYPING_REPLY
 
-async def process_bulk_input(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Process the bulk input from the user"""
-    raw_text = update.message.text
-    fields = context.user_data['fields']
-    field_mappings = context.user_data.get('field_mappings', {})
-    
-    # Initialize data dictionary
-    form_data = {}
-    
-    # Parse the input line by line
-    lines = raw_text.strip().split('\n')
-    
-    # Track which fields were filled
-    filled_fields = []
-    missing_fields = []
-    
-    for field in fields:
-        # Get the display name used in the template
-        display_name = field_mappings.get(field, get_display_name(field))
-        
-        # Look for the field in the input
-        found = False
-        for line in lines:
-            if line.startswith(f"{display_name}:"):
-                # Extract the value after the colon
-                value = line[len(display_name)+1:].strip()
-                
-                # Ignore placeholder text
-                if value and value != "[Enter value here]":
-                    form_data[field] = value
-                    filled_fields.append(field)
-                    found = True
-                    break
-        
-        if not found:
-            missing_fields.append(display_name)
-    
-    if missing_fields:
-        # Some fields are missing
-        missing_text = "\n".join(missing_fields)
-        await update.message.reply_text(
-            f"The following fields are missing or have no value:\n\n{missing_text}\n\n"
-            f"Please provide values for all fields.",
-            reply_markup=ReplyKeyboardRemove(),
-        )
-        return BULK_ENTRY
-    
-    # Save the form data
-    context.user_data['form_data'] = form_data
-    
-    # Generate the PDF
-    await update.message.reply_text(
-        "Thanks! Generating your PDF with the provided values...",
-        reply_markup=ReplyKeyboardRemove(),
+async def fill_remaining_at_once(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Switch from filling fields one-by-one to entering all the remaining ones at once"""
+    session = get_session(context)
+    remaining_fields = [field for field in session.fields if field in session.remaining]
+    
+    await send_bulk_template(
+        update.message, remaining_fields, session.field_mappings, session.field_index,
+        "Please fill in values for the remaining fields below:\n\n",
     )
-    
-    # Use the same PDF generation logic as in received_information
-    template_name = context.user_data['template_name']
-    template = context.user_data['template']
-    
-    # Create output directory if it doesn't exist
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    return BULK_ENTRY
+
+async def send_filled_pdf(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Generate the filled PDF from the collected form data and send it to the user"""
+    session = get_session(context)
+    form_data = session.form_data
+    field_mappings = session.field_mappings
+    safe_template_name = session.safe_template_name
+    template = session.template
     
     # Generate filename based on form name and timestamp
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    output_filename = f"filled_{template_name.replace(' ', '_')}_{timestamp}.pdf"
+    output_filename = f"filled_{safe_template_name}_{timestamp}.pdf"
     output_path = os.path.join(OUTPUT_DIR, output_filename)
     
-    # Generate the PDF
-    pdf_success = generate_pdf(form_data, template, output_path)
+    # Generate the PDF in memory
+    pdf_buffer = io.BytesIO()
+    pdf_success = await asyncio.to_thread(
+        generate_pdf, form_data, template, pdf_buffer, session.field_index
+    )
     
     if pdf_success:
-        # Send the PDF to the user
+        # Form data summary as HTML, one line per field, with names and values escaped
+        summary_parts = ["<b>Form Data Summary:</b>\n"]
+        summary_parts.extend(
+            f"<b>{html.escape(field_mappings.get(field) or get_display_name(field))}:</b> {html.escape(value)}\n"
+            for field, value in form_data.items()
+        )
+        summary = "".join(summary_parts)
+        
+        # Send the summary and the next-action keyboard along with the PDF when they fit in the caption
+        caption = f"Here's your filled PDF!\n\n{summary}\nWhat would you like to do next?"
+        summary_in_caption = len(caption) <= MessageLimit.CAPTION_LENGTH
+        if not summary_in_caption:
+            caption = "Here's your filled PDF! What would you like to do next?"
+        
+        # Send the PDF to the user while a copy is saved to disk for "Send Again"
         try:
-            with open(output_path, 'rb') as pdf_file:
-                await update.message.reply_document(
-                    document=pdf_file,
+            pdf_bytes = pdf_buffer.getvalue()
+            saved, _ = await asyncio.gather(
+                asyncio.to_thread(
+                    save_generated_pdf, update.effective_user.id, output_path, output_filename, pdf_bytes
+                ),
+                update.message.reply_document(
+                    document=pdf_bytes,
                     filename=output_filename,
-                    caption="Here's your filled PDF!"
-                )
-                
-            # Save the path for potential re-sending
-            context.user_data['last_pdf_path'] = output_path
-            context.user_data['last_pdf_filename'] = output_filename
-            
-            # Offer options for what to do next
-            reply_keyboard = [['Send Again'], ['New Form'], ['Exit']]
-            await update.message.reply_text(
-                "What would you like to do next?",
-                reply_markup=ReplyKeyboardMarkup(reply_keyboard, one_time_keyboard=True),
-            )
-            
-            # Add completed message with form data summary
-            summary = "*Form Data Summary:*\n"
-            for field, value in form_data.items():
-                display_name = field_mappings.get(field, get_display_name(field))
-                summary += f"*{display_name}:* {value}\n"
-            
-            await update.message.reply_text(
-                summary,
-                parse_mode=ParseMode.MARKDOWN,
+                    caption=caption,
+                    parse_mode=ParseMode.HTML,
+                    reply_markup=NEXT_ACTION_KEYBOARD,
+                ),
             )
-            
-            return CHOOSING_NEXT_ACTION
         except Exception as e:
-            logger.error(f"Error sending PDF: {e}")
+            logger.error("Error sending PDF: %s", e)
             await update.message.reply_text(
                 "The PDF was generated, but I couldn't send it to you. Please try again."
             )
             # Clear user data
             context.user_data.clear()
             return ConversationHandler.END
+        
+        # Keep the PDF for potential re-sending
+        session.last_pdf_bytes = pdf_bytes
+        session.last_pdf_filename = output_filename
+        if saved:
+            session.last_pdf_path = output_path
+        
+        # A summary too long for the caption follows the PDF; failing to send it doesn't lose the PDF
+        if not summary_in_caption:
+            try:
+                await reply_in_chunks(update.message, summary_parts, parse_mode=ParseMode.HTML)
+            except Exception as e:
+                logger.error("Error sending form data summary: %s", e)
+        
+        return CHOOSING_NEXT_ACTION
     else:
         await update.message.reply_text(
             "Sorry, there was an error generating your PDF."
@@ -838,102 +1306,127 @@ async def process_bulk_input(update: Update, context: ContextTypes.DEFAULT_TYPE)
         context.user_data.clear()
         return ConversationHandler.END
 
+async def process_bulk_input(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Process the bulk input from the user"""
+    raw_text = update.message.text
+    session = get_session(context)
+    field_mappings = session.field_mappings
+    
+    # Only fields not already filled one-by-one are expected, in form order
+    fields = [field for field in session.fields if field in session.remaining]
+    
+    # Get the display names used in the template
+    display_names = {field: field_mappings.get(field) or get_display_name(field) for field in fields}
+    
+    # Custom display names may contain ':' themselves, so those are matched as prefixes, longest first
+    colon_names = sorted((name for name in display_names.values() if ':' in name), key=len, reverse=True)
+    
+    # Initialize data dictionary
+    form_data = {}
+    
+    # Parse the input line by line into {display_name: value}, keeping the first real value
+    values = {}
+    for line in raw_text.strip().split('\n'):
+        line = line.strip()
+        for name in colon_names:
+            if line.startswith(f"{name}:"):
+                display_name, colon, value = name, ':', line[len(name) + 1:]
+                break
+        else:
+            display_name, colon, value = line.partition(':')
+        value = value.strip()
+        
+        # Ignore placeholder text
+        if colon and value and value != "[Enter value here]":
+            values.setdefault(display_name.strip(), value)
+    
+    # Track which fields are missing, and checkbox/radio fields given a value they don't accept
+    missing_fields = []
+    invalid_fields = []
+    
+    for field in fields:
+        display_name = display_names[field]
+        value = values.get(display_name)
+        if value is None:
+            missing_fields.append(display_name)
+            continue
+        
+        choices = button_choices(session.field_index, field)
+        if choices:
+            value = match_button_choice(value, choices)
+            if value is None:
+                invalid_fields.append(f"{display_name} (one of: {', '.join(choices)})")
+                continue
+        form_data[field] = value
+    
+    if missing_fields or invalid_fields:
+        # Some fields are missing or invalid
+        problems = []
+        if missing_fields:
+            missing_text = "\n".join(missing_fields)
+            problems.append(f"The following fields are missing or have no value:\n\n{missing_text}")
+        if invalid_fields:
+            invalid_text = "\n".join(invalid_fields)
+            problems.append(f"The following fields have a value they don't accept:\n\n{invalid_text}")
+        await update.message.reply_text(
+            "\n\n".join(problems) + "\n\nPlease provide values for all fields.",
+            reply_markup=REMOVE_KEYBOARD,
+        )
+        return BULK_ENTRY
+    
+    # Save the form data
+    session.form_data.update(form_data)
+    
+    # Generate the PDF
+    await update.message.reply_text(
+        "Thanks! Generating your PDF with the provided values...",
+        reply_markup=REMOVE_KEYBOARD,
+    )
+    
+    return await send_filled_pdf(update, context)
+
 async def received_information(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Store user info and ask for the next field."""
     text = update.message.text
-    field = context.user_data['choice']
-    
-    # Initialize form_data if not exists
-    if 'form_data' not in context.user_data:
-        context.user_data['form_data'] = {}
+    session = get_session(context)
+    field = session.choice
+    
+    # Checkbox and radio values have to be one of the field's states
+    choices = button_choices(session.field_index, field)
+    if choices:
+        value = match_button_choice(text, choices)
+        if value is None:
+            await update.message.reply_text(
+                f"'{text}' isn't a valid value for this field. Please choose one of: {', '.join(choices)}",
+                reply_markup=ReplyKeyboardMarkup([[choice] for choice in choices], one_time_keyboard=True),
+            )
+            return TYPING_REPLY
+        text = value
     
     # Store the entered value
-    context.user_data['form_data'][field] = text
+    session.form_data[field] = text
+    remaining = session.remaining
+    remaining.discard(field)
     
     # Get field mappings for better display
-    field_mappings = context.user_data.get('field_mappings', {})
+    field_mappings = session.field_mappings
     
     # Check if all fields are filled
-    if len(context.user_data['form_data']) == len(context.user_data['fields']):
-        await update.message.reply_text(
-            "Great! All fields are filled. Generating your PDF...",
-            reply_markup=ReplyKeyboardRemove(),
-        )
-        
-        # Generate PDF
-        form_data = context.user_data['form_data']
-        template_name = context.user_data['template_name']
-        template = context.user_data['template']
-        
-        # Create output directory if it doesn't exist
-        os.makedirs(OUTPUT_DIR, exist_ok=True)
-        
-        # Generate filename based on form name and timestamp
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        output_filename = f"filled_{template_name.replace(' ', '_')}_{timestamp}.pdf"
-        output_path = os.path.join(OUTPUT_DIR, output_filename)
-        
-        # Generate the PDF
-        pdf_success = generate_pdf(form_data, template, output_path)
-        
-        if pdf_success:
-            # Send the PDF to the user
-            try:
-                with open(output_path, 'rb') as pdf_file:
-                    await update.message.reply_document(
-                        document=pdf_file,
-                        filename=output_filename,
-                        caption="Here's your filled PDF!"
-                    )
-                    
-                # Save the path for potential re-sending
-                context.user_data['last_pdf_path'] = output_path
-                context.user_data['last_pdf_filename'] = output_filename
-                
-                # Offer options for what to do next
-                reply_keyboard = [['Send Again'], ['New Form'], ['Exit']]
-                await update.message.reply_text(
-                    "What would you like to do next?",
-                    reply_markup=ReplyKeyboardMarkup(reply_keyboard, one_time_keyboard=True),
-                )
-                
-                # Add completed message with form data summary
-                summary = "*Form Data Summary:*\n"
-                for field, value in form_data.items():
-                    display_name = field_mappings.get(field, get_display_name(field))
-                    summary += f"*{display_name}:* {value}\n"
-                
-                await update.message.reply_text(
-                    summary,
-                    parse_mode=ParseMode.MARKDOWN,
-                )
-                
-                return CHOOSING_NEXT_ACTION
-            except Exception as e:
-                logger.error(f"Error sending PDF: {e}")
-                await update.message.reply_text(
-                    "The PDF was generated, but I couldn't send it to you. Please try again."
-                )
-                # Clear user data
-                context.user_data.clear()
-                return ConversationHandler.END
-        else:
-            await update.message.reply_text(
-                "Sorry, there was an error generating your PDF."
-            )
-            # Clear user data
-            context.user_data.clear()
-            return ConversationHandler.END
+    if not remaining:
+        return await send_filled_pdf(update, context)
     
-    # If not all fields are filled, ask for the next one
-    remaining_fields = [f for f in context.user_data['fields'] if f not in context.user_data['form_data']]
-    reply_keyboard = []
-    for field in remaining_fields:
-        display_name = field_mappings.get(field, get_display_name(field))
-        reply_keyboard.append([display_name])
+    # If not all fields are filled, ask for the next one (in form order)
+    reply_keyboard = [
+        row for remaining_field, row in zip(session.fields, session.field_keyboard_rows)
+        if remaining_field in remaining
+    ]
+    
+    # Offer to send the rest in one message rather than one field at a time
+    if len(remaining) >= FILL_REMAINING_MIN_FIELDS:
+        reply_keyboard.append([FILL_REMAINING_AT_ONCE])
     
     # Get display name for the field that was just filled
-    display_name = field_mappings.get(field, get_display_name(field))
+    display_name = field_mappings.get(field) or get_display_name(field)
     
     await update.message.reply_text(
         f"Perfect! '{display_name}' set to '{text}'.\n\n"
@@ -946,26 +1439,26 @@ async def received_information(update: Update, context: ContextTypes.DEFAULT_TYP
 async def handle_next_action(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handle user's choice after completing a form."""
     choice = update.message.text
+    session = get_session(context)
     
     if choice == "Send Again":
         # Resend the PDF
         try:
-            pdf_path = context.user_data.get('last_pdf_path')
-            filename = context.user_data.get('last_pdf_filename')
+            pdf_bytes = session.last_pdf_bytes
+            pdf_path = session.last_pdf_path
+            filename = session.last_pdf_filename
             
-            if pdf_path and os.path.exists(pdf_path):
-                with open(pdf_path, 'rb') as pdf_file:
-                    await update.message.reply_document(
-                        document=pdf_file,
-                        filename=filename,
-                        caption="Here's your filled PDF again!"
-                    )
-                
-                # Ask again what to do next
-                reply_keyboard = [['Send Again'], ['New Form'], ['Exit']]
-                await update.message.reply_text(
-                    "What would you like to do next?",
-                    reply_markup=ReplyKeyboardMarkup(reply_keyboard, one_time_keyboard=True),
+            # Fall back to the saved copy if the bytes aren't held in memory
+            if pdf_bytes is None and pdf_path and os.path.exists(pdf_path):
+                pdf_bytes = await asyncio.to_thread(read_pdf_bytes, pdf_path)
+            
+            if pdf_bytes is not None:
+                # Ask again what to do next along with the PDF
+                await update.message.reply_document(
+                    document=pdf_bytes,
+                    filename=filename,
+                    caption="Here's your filled PDF again! What would you like to do next?",
+                    reply_markup=NEXT_ACTION_KEYBOARD,
                 )
                 return CHOOSING_NEXT_ACTION
             else:
@@ -976,7 +1469,7 @@ async def handle_next_action(update: Update, context: ContextTypes.DEFAULT_TYPE)
                 context.user_data.clear()
                 return await form(update, context)
         except Exception as e:
-            logger.error(f"Error resending PDF: {e}")
+            logger.error("Error resending PDF: %s", e)
             await update.message.reply_text(
                 "Sorry, I couldn't resend the PDF. Let's start over."
             )
@@ -992,7 +1485,7 @@ async def handle_next_action(update: Update, context: ContextTypes.DEFAULT_TYPE)
         # End the conversation
         await update.message.reply_text(
             "Thank you for using the AutoPDF Bot. Goodbye!",
-            reply_markup=ReplyKeyboardRemove(),
+            reply_markup=REMOVE_KEYBOARD,
         )
         context.user_data.clear()
         return ConversationHandler.END
@@ -1000,7 +1493,7 @@ async def handle_next_action(update: Update, context: ContextTypes.DEFAULT_TYPE)
     # Default fallback
     await update.message.reply_text(
         "I didn't understand that. Let's start over.",
-        reply_markup=ReplyKeyboardRemove(),
+        reply_markup=REMOVE_KEYBOARD,
     )
     context.user_data.clear()
     return await form(update, context)
@@ -1010,20 +1503,31 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     context.user_data.clear()
     await update.message.reply_text(
         "Operation cancelled.", 
-        reply_markup=ReplyKeyboardRemove()
+        reply_markup=REMOVE_KEYBOARD
     )
     return ConversationHandler.END
 
-async def view_field_names(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def conversation_timed_out(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Drop the data of a conversation that was left unfinished for too long"""
+    # After a PDF was delivered the conversation just waits on the next-action menu, so end it quietly
+    form_completed = get_session(context).last_pdf_bytes is not None
+    context.user_data.clear()
+    if update.effective_message and not form_completed:
+        await update.effective_message.reply_text(
+            "This session has timed out. Send /form to start again.",
+            reply_markup=REMOVE_KEYBOARD,
+        )
+
+async def view_field_names(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """View the field names of a PDF template to help with creating mappings"""
     # Get available forms from Google Drive
-    templates = list_pdf_templates()
+    templates = await asyncio.to_thread(list_pdf_templates)
     
     if not templates:
         await update.message.reply_text(
             "No PDF forms found in your Google Drive. Please upload at least one PDF form."
         )
-        return
+        return ConversationHandler.END
     
     # Create keyboard with form options
     reply_keyboard = [[template['name']] for template in templates]
@@ -1035,92 +1539,153 @@ async def view_field_names(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         ),
     )
     
-    # Set up a one-time handler for the response
-    context.user_data['awaiting_template_for_fields'] = True
-    
-    # Register a one-time handler
-    application = context.application
-    application.add_handler(
-        MessageHandler(
-            filters.TEXT & ~filters.COMMAND & filters.User(update.effective_user.id),
-            view_template_fields,
-            one_time=True
-        )
-    )
+    return VIEWING_FIELDS
 
-async def view_template_fields(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def view_template_fields(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Show the field names of the selected template"""
     template_name = update.message.text
     
-    # Get available forms from Google Drive
-    templates = list_pdf_templates()
-    
-    # Find the selected template
-    template_id = None
-    for template in templates:
-        if template['name'] == template_name:
-            template_id = template['id']
-            break
-    
-    if not template_id:
+    # Look up the selected template
+    selected_template = await asyncio.to_thread(find_template, template_name)
+    if not selected_template:
         await update.message.reply_text(
             "Sorry, I couldn't find that template. Please try again."
         )
-        return
+        return VIEWING_FIELDS
+    template_id = selected_template['id']
     
-    # Download the template
+    # Download the template and extract its fields, starting before the progress message is sent
+    load_task = asyncio.create_task(load_template(selected_template))
     await update.message.reply_text(f"Downloading template: {template_name}...")
-    template_content = download_template_from_drive(template_id)
+    template_content, fields, _ = await load_task
     
     if not template_content:
         await update.message.reply_text(
             "Sorry, I couldn't download that template. Please try again."
         )
-        return
-    
-    # Extract fields
-    fields = extract_form_fields(template_content)
+        return VIEWING_FIELDS
     
     if not fields:
         await update.message.reply_text(
             "This PDF doesn't appear to have any fillable fields."
         )
-        return
+        return ConversationHandler.END
     
-    # Show the fields
-    message = f"Fields in template '{template_name}' (ID: {template_id}):\n\n"
+    # Show the fields, with template-specific mappings where we have them
+    template_mappings = TEMPLATE_FIELD_MAPPINGS.get(template_id, {})
+    parts = [f"Fields in template '{template_name}' (ID: {template_id}):\n\n"]
+    parts.extend(
+        f"{field} → {template_mappings[field]}\n" if field in template_mappings else f"{field}\n"
+        for field in fields
+    )
     
-    # Check if we have template-specific mappings
-    has_mappings = template_id in TEMPLATE_FIELD_MAPPINGS
+    # Add instructions for adding mappings, suggesting a default display name per field
+    parts.append("\n\nTo add these mappings to your code, add the following to TEMPLATE_FIELD_MAPPINGS:\n\n")
+    parts.append(f"'{template_id}': {{\n")
+    parts.extend(f"    '{field}': '{get_display_name(field)}',\n" for field in fields)
+    parts.append("},")
     
-    for field in fields:
-        if has_mappings and field in TEMPLATE_FIELD_MAPPINGS[template_id]:
-            display_name = TEMPLATE_FIELD_MAPPINGS[template_id][field]
-            message += f"{field} → {display_name}\n"
-        else:
-            message += f"{field}\n"
+    # Large templates don't fit in a single Telegram message
+    await reply_in_chunks(update.message, parts)
+    return ConversationHandler.END
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Process updates from different chats concurrently, but in order within a chat
     
-    # Add instructions for adding mappings
-    message += "\n\nTo add these mappings to your code, add the following to TEMPLATE_FIELD_MAPPINGS:\n\n"
-    message += f"'{template_id}': {{\n"
-    for field in fields:
-        # Suggest a default display name
-        suggested_name = get_display_name(field)
-        message += f"    '{field}': '{suggested_name}',\n"
-    message += "},"
+    A slow Drive download or PDF generation in one chat no longer delays
+    other chats, while each conversation still sees its messages one at a
+    time, as ConversationHandler expects.
+    """
     
-    await update.message.reply_text(message)
+    def __init__(self, max_concurrent_updates: int):
+        # The base class holds its semaphore while an update waits for its chat's lock,
+        # so it is left effectively unbounded and the limit is applied once the lock is held
+        super().__init__(2**31 - 1)
+        self._running = asyncio.BoundedSemaphore(max_concurrent_updates)
+        # chat_id -> [lock, number of updates holding or waiting for the lock]
+        self._chat_locks = {}
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        """Run the update's handlers while holding the lock for its chat"""
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            async with self._running:
+                await coroutine
+            return
+        
+        entry = self._chat_locks.get(chat.id)
+        if entry is None:
+            entry = self._chat_locks[chat.id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0], self._running:
+                await coroutine
+        finally:
+            # Drop the lock once no update for this chat is pending
+            entry[1] -= 1
+            if not entry[1]:
+                del self._chat_locks[chat.id]
+
+    async def initialize(self) -> None:
+        """Nothing to set up"""
+
+    async def shutdown(self) -> None:
+        """Nothing to clean up"""
+
+async def ignore_update(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Drop the update so no other handler processes it"""
+    raise ApplicationHandlerStop
+
+async def warm_up(application: Application) -> None:
+    """Load credentials, the Drive client and the template listing before the first update"""
+    started = time.monotonic()
+    templates = await asyncio.to_thread(list_pdf_templates)
+    logger.info("Warmed up Google Drive in %.2fs (%d templates)", time.monotonic() - started, len(templates))
 
 def main() -> None:
     """Run the bot."""
-    # Create the Application
-    application = Application.builder().token(os.getenv("TELEGRAM_TOKEN")).build()
+    # Create the Application with connection pools sized for concurrent conversations
+    application = (
+        Application.builder()
+        .token(TELEGRAM_TOKEN)
+        .connection_pool_size(64)
+        .pool_timeout(30)
+        .connect_timeout(15)
+        .read_timeout(60)
+        .write_timeout(60)
+        .get_updates_connection_pool_size(4)
+        .get_updates_pool_timeout(30)
+        .concurrent_updates(PerChatUpdateProcessor(MAX_CONCURRENT_UPDATES))
+        .rate_limiter(
+            AIORateLimiter(
+                overall_max_rate=25,
+                overall_time_period=1,
+                group_max_rate=18,
+                group_time_period=60,
+            )
+        )
+        .post_init(warm_up)
+        .build()
+    )
+
+    # Remove expired PDFs in the background (the job queue needs the job-queue extra)
+    if application.job_queue:
+        application.job_queue.run_repeating(cleanup_pdfs, interval=PDF_CLEANUP_INTERVAL, first=60)
+    else:
+        logger.warning("Job queue not available, expired PDFs won't be cleaned up automatically")
+
+    # Drop messages from users outside ALLOWED_USERS before any other handler sees them
+    if ALLOWED_USERS:
+        application.add_handler(
+            MessageHandler(~filters.User(user_id=ALLOWED_USERS), ignore_update), group=-1
+        )
 
     # Add conversation handler with the states
     conv_handler = ConversationHandler(
         entry_points=[
             CommandHandler("start", start),
             CommandHandler("form", form),
+            CommandHandler("fields", view_field_names),
         ],
         states={
             SELECTING_TEMPLATE: [
@@ -1131,7 +1696,7 @@ def main() -> None:
             ],
             CHOOSING_FIELD_NAMES: [
                 MessageHandler(
-                    filters.Regex("^(Customize Field Names|Use Default Names)$"),
+                    filters.Text(["Customize Field Names", "Use Default Names"]),
                     choose_field_naming,
                 )
             ],
@@ -1143,7 +1708,7 @@ def main() -> None:
             ],
             CHOOSING_FILL_METHOD: [
                 MessageHandler(
-                    filters.Regex("^(Fill Fields One-by-One|Fill All Fields at Once)$"),
+                    filters.Text(["Fill Fields One-by-One", "Fill All Fields at Once"]),
                     choose_fill_method,
                 )
             ],
@@ -1154,10 +1719,14 @@ def main() -> None:
                 )
             ],
             CHOOSING: [
+                MessageHandler(
+                    filters.Text([FILL_REMAINING_AT_ONCE]),
+                    fill_remaining_at_once,
+                ),
                 MessageHandler(
                     filters.TEXT & ~filters.COMMAND,
                     regular_choice,
-                )
+                ),
             ],
             TYPING_REPLY: [
                 MessageHandler(
@@ -1167,24 +1736,38 @@ def main() -> None:
             ],
             CHOOSING_NEXT_ACTION: [
                 MessageHandler(
-                    filters.Regex("^(Send Again|New Form|Exit)$"),
+                    filters.Text(["Send Again", "New Form", "Exit"]),
                     handle_next_action,
                 )
             ],
+            VIEWING_FIELDS: [
+                MessageHandler(
+                    filters.TEXT & ~filters.COMMAND,
+                    view_template_fields,
+                )
+            ],
+            ConversationHandler.TIMEOUT: [TypeHandler(Update, conversation_timed_out)],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
+        conversation_timeout=CONVERSATION_TIMEOUT,
     )
 
     application.add_handler(conv_handler)
 
     # Help command
     application.add_handler(CommandHandler("help", help_command))
-    
-    # Field names command
-    application.add_handler(CommandHandler("fields", view_field_names))
 
     # Start the Bot
-    application.run_polling()
+    if WEBHOOK_URL:
+        application.run_webhook(
+            listen='0.0.0.0',
+            port=PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+        )
+    else:
+        application.run_polling()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
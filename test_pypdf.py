@@ -1,10 +1,13 @@
 #!/usr/bin/env python3
-"""Test PyPDF2 for form extraction and filling"""
+"""Test pypdf for form extraction and filling
+
+Requires pypdf 4.2.0 or later (see requirements-dev.txt).
+"""
 
 import os
 import tempfile
 import logging
-from PyPDF2 import PdfReader, PdfWriter
+from pypdf import PdfReader, PdfWriter
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -34,15 +37,11 @@ def fill_pdf_form(input_pdf, output_pdf, data):
         # Read the input PDF
         reader = PdfReader(input_pdf)
         
-        # Create a PDF writer
-        writer = PdfWriter()
-        
-        # Add all pages from the input PDF
-        for page in range(len(reader.pages)):
-            writer.add_page(reader.pages[page])
+        # Create a PDF writer holding a copy of the whole document, form included
+        writer = PdfWriter(clone_from=reader)
         
-        # Update form fields with data
-        writer.update_page_form_field_values(writer.pages, data)
+        # Update form fields with data on every page
+        writer.update_page_form_field_values(None, data)
         
         # Write the filled PDF
         with open(output_pdf, "wb") as output_file:
@@ -55,7 +54,7 @@ def fill_pdf_form(input_pdf, output_pdf, data):
         return False
 
 def main():
-    """Main function to test PyPDF2"""
+    """Main function to test pypdf"""
     # Ask for the path to a PDF form
     pdf_path = input("Enter the path to a PDF form: ")
     